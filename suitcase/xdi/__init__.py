@@ -3,11 +3,22 @@
 # intended to be user-facing. They should accept the parameters sketched here,
 # but may also accept additional required or optional keyword arguments, as
 # needed.
-from collections import OrderedDict
 from datetime import datetime
+import functools
+from itertools import repeat
+import logging
+import os
 from pathlib import Path
+import re
+import shutil
+import string
 
-import toml
+try:
+    import tomllib
+except ImportError:
+    # tomllib is in the standard library from Python 3.11,
+    # toml.loads has the same signature
+    import toml as tomllib
 
 import event_model
 import suitcase.utils
@@ -17,6 +28,20 @@ from ._version import get_versions
 __version__ = get_versions()["version"]
 del get_versions
 
+logger = logging.getLogger(__name__)
+
+# the smallest number of bytes reserved for the header at the beginning of
+# the output file, the final header is written into this region by stop()
+_HEADER_REGION_SIZE = 4096
+
+# data rows are collected until they add up to this many characters and
+# then written to the output file together
+_ROW_BUFFER_SIZE = 1 << 20
+
+# column data templates with a single data value such as "{data[det1][0]}"
+# or "{data[det2][0]:.3}" can be formatted one column at a time
+_SIMPLE_COLUMN_DATA = re.compile(r"\{data\[([^\]]+)\]\[0\](?::([^{}]*))?\}")
+
 
 def export(gen, directory, file_prefix="{uid}-", **kwargs):
     """
@@ -88,6 +113,121 @@ def export(gen, directory, file_prefix="{uid}-", **kwargs):
     return serializer.artifacts
 
 
+@functools.lru_cache(maxsize=32)
+def _load_template(path, mtime):
+    """Parse an XDI configuration file.
+
+    Many runs share the same configuration file, so the parsed template is
+    cached. The file modification time is part of the cache key so an edited
+    file is parsed again. Callers must not modify the returned template.
+
+    Parameters
+    ----------
+    path : str
+        path to the TOML configuration file
+    mtime : int
+        modification time of the file in nanoseconds, used only as part of
+        the cache key
+
+    Returns
+    -------
+    template : dict
+        the parsed configuration
+    """
+    # TOML files are always UTF-8 whatever the locale encoding is
+    return tomllib.loads(Path(path).read_text(encoding="utf-8"))
+
+
+def _parse_simple_column_data(column_data):
+    """Find the data key and format spec of a single data value template.
+
+    Parameters
+    ----------
+    column_data : str
+        a column data template such as "{data[det1][0]:.3}"
+
+    Returns
+    -------
+    (data_key, format_spec) : tuple of str, or None
+        None if the template is anything other than a single data value
+    """
+    match = _SIMPLE_COLUMN_DATA.fullmatch(column_data)
+    # str.format looks up keys made of digits as integers
+    if match is None or match.group(1).isdigit():
+        return None
+    data_key, format_spec = match.groups()
+    return data_key, format_spec or ""
+
+
+def _copy_to_end(source, destination, offset):
+    """Copy the contents of a file from offset to the end into another file.
+
+    os.sendfile copies file to file inside the kernel on Linux, elsewhere
+    it may not exist or may accept only a socket as the destination.
+
+    Parameters
+    ----------
+    source : file
+        a file opened for reading in binary mode
+    destination : file
+        a file opened for writing in binary mode
+    offset : int
+        the position in source to start copying from
+    """
+    destination.flush()
+    position = offset
+    if hasattr(os, "sendfile"):
+        size = os.fstat(source.fileno()).st_size
+        try:
+            while position < size:
+                sent = os.sendfile(
+                    destination.fileno(), source.fileno(), position, size - position
+                )
+                if sent == 0:
+                    break
+                position += sent
+            return
+        except OSError:
+            if position > offset:
+                raise
+
+    source.seek(offset)
+    shutil.copyfileobj(source, destination)
+
+
+def _template_fields(template):
+    """Find the top level fields of a format string.
+
+    Parameters
+    ----------
+    template : str
+        a format string such as "{md[XDI][Element_symbol]}"
+
+    Returns
+    -------
+    fields : frozenset of str
+        the top level field names, for example {"md"}
+    """
+    return frozenset(
+        re.split(r"[.\[]", field_name, maxsplit=1)[0]
+        for _, field_name, _, _ in string.Formatter().parse(template)
+        if field_name
+    )
+
+
+def _single_event_pages(event_page):
+    """Split an event page into event pages holding one event each.
+
+    Column data templates index the page, as in "{data[det1][0]}", so each
+    row of data is formatted from a page holding only that event.
+    """
+    if len(event_page["seq_num"]) == 1:
+        yield event_page
+    else:
+        for event in event_model.unpack_event_page(event_page):
+            yield event_model.pack_event_page(event)
+
+
 class Serializer(event_model.DocumentRouter):
     """
     Serialize a stream of documents to xdi.
@@ -135,11 +275,27 @@ class Serializer(event_model.DocumentRouter):
         self._file_prefix = file_prefix
         self._kwargs = kwargs
         self._templated_file_prefix = ""  # set when we get a 'start' document
-        self._event_descriptor_uids = set()
+        self._event_descriptor_uids = frozenset()
         self._xdi_file_template = None
-        self._header_line_buffer = OrderedDict()
+        self._header_line_buffer = {}
+        self._header_prefixes = {}
+        # header field templates and the top level document fields they need
+        self._header_templates = {}
+        self._header_template_fields = {}
+        # header fields still waiting for a value, one set per template section
+        self._pending_versions = set()
+        self._pending_columns = set()
+        self._pending_required = set()
+        self._pending_optional = set()
+        self._header_region_len = None
         self.columns = None
+        self._column_templates = None
+        self._column_labels = None
+        self._format_row = None
+        self._simple_columns = None
+        self._column_labels_header = None
         self.export_data_keys = None
+        self._export_data_keys_set = None
 
         if isinstance(directory, (str, Path)):
             # The user has given us a filepath; they want files.
@@ -159,6 +315,8 @@ class Serializer(event_model.DocumentRouter):
         #
         # self._files = {}
         self._output_file = None
+        self._row_buffer = []
+        self._row_buffer_len = 0
 
     @property
     def artifacts(self):
@@ -177,6 +335,8 @@ class Serializer(event_model.DocumentRouter):
         """
         Close all of the resources (e.g. files) allocated.
         """
+        # data rows are left in the buffer if no stop document arrived
+        self._flush_rows()
         self._manager.close()
 
     # These methods enable the Serializer to be used as a context manager:
@@ -192,11 +352,25 @@ class Serializer(event_model.DocumentRouter):
     def __exit__(self, *exception_details):
         self.close()
 
+    def __call__(self, name, doc, validate=False):
+        # events and event pages make up nearly all of the documents in a run
+        # so call their methods directly rather than through the DocumentRouter
+        # dispatch, the result is the same as DocumentRouter.__call__
+        if not validate:
+            if name == "event_page":
+                output_doc = self.event_page(doc)
+                return name, output_doc if output_doc is not None else doc
+            elif name == "event":
+                output_doc = self.event(doc)
+                return name, output_doc if output_doc is not None else doc
+        return super().__call__(name, doc, validate)
+
     # Each of the methods below corresponds to a document type. As
-    # documents flow in through Serializer.__call__, the DocumentRouter base
-    # class will forward them to the method with the name corresponding to
-    # the document's type: RunStart documents go to the 'start' method,
-    # etc.
+    # documents flow in through Serializer.__call__, events and event pages
+    # go straight to the 'event' and 'event_page' methods, and the
+    # DocumentRouter base class forwards the other documents to the method
+    # with the name corresponding to the document's type: RunStart documents
+    # go to the 'start' method, etc.
     #
     # In each of these methods:
     #
@@ -223,12 +397,12 @@ class Serializer(event_model.DocumentRouter):
             raise Exception("")
 
         if "config" in doc["md"]["suitcase-xdi"]:
-            self._xdi_file_template = toml.loads(
-                doc["md"]["suitcase-xdi"]["config"], _dict=OrderedDict
-            )
+            self._xdi_file_template = tomllib.loads(doc["md"]["suitcase-xdi"]["config"])
         elif "config-file-path" in doc["md"]["suitcase-xdi"]:
-            self._xdi_file_template = toml.load(
-                doc["md"]["suitcase-xdi"]["config-file-path"], _dict=OrderedDict
+            config_file_path = doc["md"]["suitcase-xdi"]["config-file-path"]
+            # the cached template is shared between serializers and is only read
+            self._xdi_file_template = _load_template(
+                config_file_path, os.stat(config_file_path).st_mtime_ns
             )
         else:
             raise Exception(
@@ -265,49 +439,113 @@ class Serializer(event_model.DocumentRouter):
         }
         """
 
-        # initialize the header line buffer to "None" for every header line
-        self._initialize_header_line_buffer(start_doc=doc)
+        # a header field template is formatted only for documents with all of
+        # its top level fields, most documents are missing some of them
+        for template_section, template_key in (
+            ("columns", "column_label"),
+            ("required_headers", "data"),
+            ("optional_headers", "data"),
+        ):
+            for xdi_key, xdi_value in self._xdi_file_template[template_section].items():
+                if template_key in xdi_value:
+                    template = xdi_value[template_key]
+                    self._header_templates[xdi_key] = template
+                    self._header_template_fields[xdi_key] = _template_fields(template)
 
-        # extract header information from the start document
-        self._update_header_lines_from_doc(doc_name="start", doc=doc)
+        # initialize the header line buffer to "None" for every header line
+        # and extract header information from the start document
+        self._update_header_lines_from_doc(doc_name="start", doc=doc, initialize=True)
+
+        # the header fields never change so the "# key = " part of each
+        # header line is the same every time the header is written
+        self._header_prefixes = {
+            header_field: f"# {header_field} = "
+            for header_field in self._header_line_buffer
+        }
 
         # Fill in the file_prefix with the contents of the RunStart document.
         # As in, '{uid}' -> 'c1790369-e4b2-46c7-a294-7abfa239691a'
         # or 'my-data-from-{plan-name}' -> 'my-data-from-scan'
-        self._templated_file_prefix = self._file_prefix.format(**doc)
-        filename = f"{self._templated_file_prefix}.xdi"
-        self._output_file = self._manager.open("stream_data", filename, "xt")
+        # the file itself is opened when the first event with data to export
+        # arrives, runs without any such events produce no file
+        self._templated_file_prefix = self._file_prefix.format_map(doc)
 
-        self.columns = tuple([v for k, v in self._xdi_file_template["columns"].items()])
+        self.columns = tuple(self._xdi_file_template["columns"].values())
         if len(self.columns) == 0:
             raise ValueError("found no Columns")
 
-        self.export_data_keys = tuple({c["data_key"] for c in self.columns})
+        # remove duplicate data keys but keep the column order
+        self.export_data_keys = tuple(
+            dict.fromkeys(c["data_key"] for c in self.columns)
+        )
+        self._export_data_keys_set = frozenset(self.export_data_keys)
+
+        # pull the column templates and labels out of the column tables
+        self._column_templates = tuple(c["column_data"] for c in self.columns)
+        self._column_labels = tuple(c["column_label"] for c in self.columns)
 
-        # write the header information we have now
-        # the full header will be written when the stop document arrives
-        self._write_header()
+        # the last header line is the same every time the header is written
+        self._column_labels_header = "# " + "\t".join(self._column_labels)
 
-    def _write_header(self, output_file=None):
-        """Write all header information, "None" for missing information.
+        # join the column templates into one row template so each event is
+        # formatted with a single format_map call rather than one per column
+        self._format_row = ("\t".join(self._column_templates) + "\n").format_map
 
-        """
-        if output_file is None:
-            output_file = self._output_file
+        # if every column is a single data value then event pages with many
+        # events can be formatted one column at a time
+        simple_columns = tuple(
+            _parse_simple_column_data(column_data)
+            for column_data in self._column_templates
+        )
+        if None not in simple_columns:
+            self._simple_columns = simple_columns
+
+    def _open_output_file(self):
+        """Open the output file and write the header information we have now."""
+        filename = f"{self._templated_file_prefix}.xdi"
+        self._output_file = self._manager.open("stream_data", filename, "xb")
 
+        # the full header will be written when the stop document arrives
+        # so reserve room for it; missing values may become much longer
+        # than "None"
+        self._header_region_len = max(
+            _HEADER_REGION_SIZE, 2 * len(self._format_header().encode())
+        )
+        self._write_header_region()
+
+    def _format_header(self):
+        """Return all header information, "None" for missing information."""
         # the first line is a special case - only print the value, not the key
         # TODO: simplify this special case by keeping the entire line in the header line buffer values
-        header_lines = self._header_line_buffer.copy()
-        output_file.write(header_lines.pop("XDI"))
-        output_file.write("\n")
-        for header_field, header_value in header_lines.items():
-            # self._write_xdi_row(xdi_header_field_name=header_field, xdi_field_value_template=header_value)
-            output_file.write("# {} = {}\n".format(header_field, header_value))
-
-        output_file.write("#----\n")
-        output_file.write(
-            "# {}\n".format("\t".join([c["column_label"] for c in self.columns]))
+        header_lines = [self._header_line_buffer["XDI"]]
+        header_lines.extend(
+            self._header_prefixes[header_field] + str(header_value)
+            for header_field, header_value in self._header_line_buffer.items()
+            if header_field != "XDI"
         )
+        header_lines.append("#----")
+        header_lines.append(self._column_labels_header)
+        return "\n".join(header_lines) + "\n"
+
+    def _write_header_region(self):
+        """Write the header padded to the length of the reserved header region.
+
+        The padding is trailing whitespace on the last header line, the column
+        labels.
+
+        Returns
+        -------
+        bool
+            False if the header is longer than the reserved region, in which
+            case nothing is written
+        """
+        header = self._format_header().encode()
+        padding = self._header_region_len - len(header)
+        if padding < 0:
+            return False
+
+        self._output_file.write(header[:-1] + b" " * padding + b"\n")
+        return True
 
     def descriptor(self, doc):
         """
@@ -320,8 +558,8 @@ class Serializer(event_model.DocumentRouter):
             an event-descriptor document
         """
         descriptor_data_keys = doc["data_keys"]
-        if set(self.export_data_keys).issubset(descriptor_data_keys.keys()):
-            self._event_descriptor_uids.add(doc["uid"])
+        if self._export_data_keys_set <= descriptor_data_keys.keys():
+            self._event_descriptor_uids |= {doc["uid"]}
             # self._output_file.write("#----\n")
             # header_list = [c["column_label"].format(**doc) for c in self.columns]
             # self._output_file.write("# {}\n".format("\t".join(header_list)))
@@ -330,131 +568,185 @@ class Serializer(event_model.DocumentRouter):
 
         self._update_header_lines_from_doc(doc_name="descriptor", doc=doc)
 
+    def event(self, doc):
+        # the data of an event is written by event_page, not every version of
+        # DocumentRouter.event converts the event to an event page
+        return self.event_page(event_model.pack_event_page(doc))
+
     def event_page(self, doc):
         # There are other representations of Event data -- 'event' and
         # 'bulk_events' (deprecated). But that does not concern us because
-        # DocumentRouter will convert these representations to 'event_page'
-        # then route them through here.
-
-        if len(self._event_descriptor_uids) == 0:
-            print(
-                "have not seen a descriptor with data keys {self.export_data_keys} yet"
+        # Serializer.event and DocumentRouter convert these representations
+        # to 'event_page' then route them through here.
+
+        # check for the common case first
+        if doc["descriptor"] in self._event_descriptor_uids:
+            if self._output_file is None:
+                self._open_output_file()
+            if self._simple_columns is not None and len(doc["seq_num"]) > 1:
+                data = doc["data"]
+                rows = zip(
+                    *(
+                        map(format, data[data_key], repeat(format_spec))
+                        for data_key, format_spec in self._simple_columns
+                    )
+                )
+                page_text = "".join("\t".join(row) + "\n" for row in rows)
+            else:
+                page_text = "".join(map(self._format_row, _single_event_pages(doc)))
+            # all of the rows from this page are buffered as one string
+            self._row_buffer.append(page_text)
+            self._row_buffer_len += len(page_text)
+            if self._row_buffer_len >= _ROW_BUFFER_SIZE:
+                self._flush_rows()
+        elif len(self._event_descriptor_uids) == 0:
+            logger.debug(
+                "have not seen a descriptor with data keys %s yet",
+                self.export_data_keys,
             )
-        elif doc["descriptor"] in self._event_descriptor_uids:
-            column_list = [
-                column["column_data"].format(**doc) for column in self.columns
-            ]
-            self._output_file.write("\t".join(column_list))
-            self._output_file.write("\n")
         else:
-            print(f"this event has no data to export")
+            logger.debug("this event has no data to export")
+
+    def _flush_rows(self):
+        """Write buffered data rows to the output file."""
+        if self._row_buffer:
+            self._output_file.write("".join(self._row_buffer).encode())
+            self._row_buffer.clear()
+            self._row_buffer_len = 0
 
     def stop(self, doc):
+        if self._output_file is None:
+            # there was no data to export so there is no file to finish
+            return
+
         self._update_header_lines_from_doc(doc_name="stop", doc=doc)
+        self._flush_rows()
+        # overwrite the header region reserved in start()
+        self._output_file.seek(0)
+        header_fits = self._write_header_region()
         self._manager.close()
+        if header_fits:
+            return
+
+        # the full header does not fit in the reserved region
+        # so rewrite the file with the full header
         for artifact_label, artifacts in self._manager.artifacts.items():
             for artifact in artifacts:
-                print("finishing artifact {}".format(artifact))
-                temp_artifact_path = artifact.with_suffix(".updating")
-                print("creating {}".format(temp_artifact_path))
-                with artifact.open() as a, temp_artifact_path.open("wt") as t:
-                    # write a fresh header
-                    self._write_header(output_file=t)
-                    for line in a:
-                        if line.startswith("#"):
-                            # already wrote the header
-                            pass
-                        else:
-                            # write a line of data
-                            t.write(line)
-                artifact.unlink()
-                temp_artifact_path.rename(artifact)
-
-    def _initialize_header_line_buffer(self, start_doc):
-
-        for k, v in self._xdi_file_template["versions"].items():
-            self._header_line_buffer[k] = None
-
-        for xdi_key, xdi_value in self._xdi_file_template["columns"].items():
-            try:
-                header_field_value = xdi_value["column_label"].format(**start_doc)
-                if "units" in xdi_value:
-                    self._header_line_buffer[xdi_key] = (
-                        f"{header_field_value} " + xdi_value["units"]
-                    )
+                logger.debug("finishing artifact %s", artifact)
+                if isinstance(artifact, Path):
+                    self._rewrite_file(artifact)
                 else:
-                    self._header_line_buffer[xdi_key] = f"{header_field_value}"
-            except KeyError as ke:
-                print(ke)
-                self._header_line_buffer[xdi_key] = None
-
-        for xdi_key, xdi_value in self._xdi_file_template["required_headers"].items():
-            try:
-                self._header_line_buffer[xdi_key] = xdi_value["data"].format(
-                    **start_doc
+                    # MemoryBuffersManager artifacts are the buffers themselves
+                    self._rewrite_buffer(artifact)
+
+    def _rewrite_file(self, artifact_path):
+        """Replace the header region of a file with the full header."""
+        temp_artifact_path = artifact_path.with_suffix(".updating")
+        logger.debug("creating %s", temp_artifact_path)
+        with artifact_path.open("rb") as a, temp_artifact_path.open("wb") as t:
+            # write a fresh header
+            t.write(self._format_header().encode())
+            # copy the data following the header region
+            _copy_to_end(a, t, self._header_region_len)
+        temp_artifact_path.replace(artifact_path)
+
+    def _rewrite_buffer(self, buffer):
+        """Replace the header region of a memory buffer with the full header."""
+        contents = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        buffer.write(self._format_header().encode())
+        buffer.write(memoryview(contents)[self._header_region_len :])
+
+    def _fill_header_template(self, xdi_key, doc):
+        """Format the template for one header field with a document.
+
+        Parameters
+        ----------
+        xdi_key : str
+            the header field, for example "Element.symbol"
+        doc : dict
+            a start, descriptor, or stop document
+
+        Returns
+        -------
+        str or None
+            None if the header field has no template or the document does not
+            have all of the fields used by the template
+        """
+        if xdi_key not in self._header_templates:
+            return None
+        # checking the top level fields first avoids raising and catching
+        # a KeyError for most of the documents without them
+        if not self._header_template_fields[xdi_key] <= doc.keys():
+            return None
+        try:
+            return self._header_templates[xdi_key].format_map(doc)
+        except KeyError as ke:
+            # a nested field such as md[XDI][Element_symbol] is missing
+            logger.debug("missing header field %s", ke)
+            return None
+
+    def _update_header_lines_from_doc(self, doc_name, doc, initialize=False):
+        """Fill in header fields that have no value yet from a document.
+
+        Parameters
+        ----------
+        doc_name : str
+            "start", "descriptor", or "stop"
+        doc : dict
+            the document
+        initialize : bool, optional
+            if True set every header field to None before filling them in,
+            this is done once with the start document
+        """
+        if initialize:
+            for template_section in (
+                "versions",
+                "columns",
+                "required_headers",
+                "optional_headers",
+            ):
+                self._header_line_buffer.update(
+                    dict.fromkeys(self._xdi_file_template[template_section])
+                )
+            self._pending_versions = set(self._xdi_file_template["versions"])
+            self._pending_columns = set(self._xdi_file_template["columns"])
+            self._pending_required = set(self._xdi_file_template["required_headers"])
+            self._pending_optional = set(self._xdi_file_template["optional_headers"])
+
+        # only the header fields with no value yet are considered,
+        # a field is removed from its pending set once it has a value
+        for k in self._pending_versions:
+            self._header_line_buffer[k] = f"{self._xdi_file_template['versions'][k]}"
+        self._pending_versions.clear()
+
+        for xdi_key in tuple(self._pending_columns):
+            xdi_value = self._xdi_file_template["columns"][xdi_key]
+            header_field_value = self._fill_header_template(xdi_key, doc)
+            if header_field_value is None:
+                continue
+            if "units" in xdi_value:
+                self._header_line_buffer[xdi_key] = (
+                    f"{header_field_value} " + xdi_value["units"]
                 )
-            except KeyError as ke:
-                print(ke)
-                self._header_line_buffer[xdi_key] = None
-
-        for xdi_key, xdi_value in self._xdi_file_template["optional_headers"].items():
-            if xdi_key == "Scan.start_time":  # and doc_name == "start":
-                header_field_value = datetime.fromtimestamp(
-                    start_doc["time"]
-                ).isoformat()
-            elif xdi_key == "Scan.end_time":  # and doc_name == "end":
-                header_field_value = None
             else:
-                try:
-                    header_field_value = xdi_value["data"].format(**start_doc)
-                except KeyError as ke:
-                    print(ke)
-                    header_field_value = None
-            self._header_line_buffer[xdi_key] = header_field_value
-
-    def _update_header_lines_from_doc(self, doc_name, doc):
-        def get_empty_header_fields(dict_):
-            return [
-                (k_, v_)
-                for (k_, v_) in dict_.items()
-                if self._header_line_buffer[k_] is None
-            ]
-
-        for k, v in get_empty_header_fields(self._xdi_file_template["versions"]):
-            self._header_line_buffer[k] = f"{v}"
-
-        for xdi_key, xdi_value in get_empty_header_fields(
-            self._xdi_file_template["columns"]
-        ):
-            try:
-                header_field_value = xdi_value["column_label"].format(**doc)
-                if "units" in xdi_value:
-                    self._header_line_buffer[xdi_key] = (
-                        f"{header_field_value} " + xdi_value["units"]
-                    )
-                else:
-                    self._header_line_buffer[xdi_key] = f"{header_field_value}"
-            except KeyError:
-                self._header_line_buffer[xdi_key] = None
+                self._header_line_buffer[xdi_key] = f"{header_field_value}"
+            self._pending_columns.discard(xdi_key)
 
-        for xdi_key, xdi_value in get_empty_header_fields(
-            self._xdi_file_template["required_headers"]
-        ):
-            try:
-                self._header_line_buffer[xdi_key] = xdi_value["data"].format(**doc)
-            except KeyError:
-                self._header_line_buffer[xdi_key] = None
+        for xdi_key in tuple(self._pending_required):
+            header_field_value = self._fill_header_template(xdi_key, doc)
+            if header_field_value is not None:
+                self._header_line_buffer[xdi_key] = header_field_value
+                self._pending_required.discard(xdi_key)
 
-        for xdi_key, xdi_value in get_empty_header_fields(
-            self._xdi_file_template["optional_headers"]
-        ):
+        for xdi_key in tuple(self._pending_optional):
             if xdi_key == "Scan.start_time" and doc_name == "start":
                 header_field_value = datetime.fromtimestamp(doc["time"]).isoformat()
             elif xdi_key == "Scan.end_time" and doc_name == "stop":
                 header_field_value = datetime.fromtimestamp(doc["time"]).isoformat()
             else:
-                try:
-                    header_field_value = xdi_value["data"].format(**doc)
-                except KeyError:
-                    header_field_value = None
-            self._header_line_buffer[xdi_key] = header_field_value
+                header_field_value = self._fill_header_template(xdi_key, doc)
+            if header_field_value is not None:
+                self._header_line_buffer[xdi_key] = header_field_value
+                self._pending_optional.discard(xdi_key)
@@ -1,3 +1,15 @@
+import os
+
+import pytest
+
+from suitcase.xdi import (
+    _copy_to_end,
+    _load_template,
+    _parse_simple_column_data,
+    _template_fields,
+)
+
+
 xdi_file_template = """\
 [versions]
 "XDI"                         = "# XDI/1.0 Bluesky"
@@ -27,3 +39,62 @@ xdi_file_template = """\
 
 def test_write_header():
     pass
+
+
+def test_load_template_cache(tmp_path):
+    config_file_path = tmp_path / "xdi.toml"
+    config_file_path.write_text(xdi_file_template)
+    mtime = os.stat(config_file_path).st_mtime_ns
+
+    template = _load_template(str(config_file_path), mtime)
+    assert template is _load_template(str(config_file_path), mtime)
+    assert list(template["columns"]) == ["Column.1", "Column.2", "Column.3"]
+
+    # a new modification time means the file is parsed again
+    assert template is not _load_template(str(config_file_path), mtime + 1)
+
+
+def test_load_template_utf8(tmp_path):
+    # TOML files are UTF-8 encoded regardless of the locale
+    config_file_path = tmp_path / "xdi.toml"
+    config_file_path.write_bytes(
+        xdi_file_template.replace('units="eV"', 'units="\u00b5m"').encode("utf-8")
+    )
+    mtime = os.stat(config_file_path).st_mtime_ns
+
+    template = _load_template(str(config_file_path), mtime)
+    assert template["columns"]["Column.1"]["units"] == "\u00b5m"
+
+
+def test_parse_simple_column_data():
+    assert _parse_simple_column_data("{data[det1][0]}") == ("det1", "")
+    assert _parse_simple_column_data("{data[det2][0]:.3}") == ("det2", ".3")
+
+    assert _parse_simple_column_data("{data[det1][0]} eV") is None
+    assert _parse_simple_column_data("{data[det1][0]!r}") is None
+    assert _parse_simple_column_data("{data[det1][1]}") is None
+    assert _parse_simple_column_data("{seq_num[0]}") is None
+    # str.format would look up an integer key
+    assert _parse_simple_column_data("{data[1][0]}") is None
+
+
+def test_template_fields():
+    assert _template_fields("{md[XDI][Element_symbol]}") == {"md"}
+    assert _template_fields("{md[NX][Beam][incident_energy]:.3f} eV") == {"md"}
+    assert _template_fields("{plan_name}-{uid}") == {"plan_name", "uid"}
+    assert _template_fields("parabolic mirror") == set()
+
+
+@pytest.mark.parametrize("use_sendfile", [True, False])
+def test_copy_to_end(tmp_path, monkeypatch, use_sendfile):
+    if not use_sendfile:
+        monkeypatch.delattr(os, "sendfile", raising=False)
+    source_path = tmp_path / "source"
+    source_path.write_bytes(b"header\n1\t2\n3\t4\n")
+    destination_path = tmp_path / "destination"
+
+    with source_path.open("rb") as source, destination_path.open("wb") as destination:
+        destination.write(b"new header\n")
+        _copy_to_end(source, destination, offset=len(b"header\n"))
+
+    assert destination_path.read_bytes() == b"new header\n1\t2\n3\t4\n"
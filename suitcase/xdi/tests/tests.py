@@ -1,6 +1,11 @@
 # Tests should generate (and then clean up) any files they need for testing. No
 # binary files should be included in the repository.
-from suitcase.xdi import export
+from pathlib import Path
+
+import event_model
+import pytest
+from suitcase.utils import MemoryBuffersManager
+from suitcase.xdi import _HEADER_REGION_SIZE, Serializer, export
 
 config = """
 [versions]
@@ -27,6 +32,16 @@ config = """
 """
 
 
+md = {
+    "XDI": {"Element_symbol": "A", "Element_edge": "K", "Mono_d_spacing": 10.0},
+    "NX": {
+        "Source": {"name": "NSLS-II"},
+        "Instrument": {"name": "BMM"},
+        "Beam": {"incident_energy": 1000.0},
+    },
+}
+
+
 def test_export(tmp_path, example_data):
     # Exercise the exporter on the myriad cases parametrized in example_data.
 
@@ -38,15 +53,7 @@ def test_export(tmp_path, example_data):
 
     documents = example_data(
         skip_tests_with=["direct_img", "direct_img_list"],
-        md={
-            "suitcase-xdi": {"config-file-path": str(config_file_path)},
-            "XDI": {"Element_symbol": "A", "Element_edge": "K", "Mono_d_spacing": 10.0},
-            "NX": {
-                "Source": {"name": "NSLS-II"},
-                "Instrument": {"name": "BMM"},
-                "Beam": {"incident_energy": 1000.0},
-            },
-        },
+        md={"suitcase-xdi": {"config-file-path": str(config_file_path)}, **md},
     )
 
     artifacts = export(documents, tmp_path)
@@ -56,3 +63,146 @@ def test_export(tmp_path, example_data):
     #    'stream_data': [PosixPath('/tmp/test_export_one_stream_multi_d11/d4ee83a9-64f7-4c25--primary.xdi')]
     #  }
     assert all([a.exists() for a in artifacts["stream_data"]])
+
+
+def test_export_to_memory_buffer(example_data):
+    # the final header is written over the header written by start()
+    # so the exporter also works with a non-file Manager
+    documents = example_data(
+        skip_tests_with=["direct_img", "direct_img_list"],
+        md={"suitcase-xdi": {"config": config}, **md},
+    )
+
+    artifacts = export(documents, MemoryBuffersManager())
+
+    for buffer in artifacts["stream_data"]:
+        header, data = buffer.getvalue().decode().split("#----\n")
+        assert header.startswith("# XDI/1.0 Bluesky\n")
+        assert "# Scan.end_time = None\n" not in header
+        assert data.startswith("# energy\tmutrans\ti0 ")
+
+
+def run_documents(xdi_config, data_key="det", as_event_page=False, reason=""):
+    # a run with three events in one stream
+    run = event_model.compose_run(
+        metadata={"md": {"suitcase-xdi": {"config": xdi_config}, **md}}
+    )
+    yield "start", run.start_doc
+    stream = run.compose_descriptor(
+        data_keys={data_key: {"source": "sim", "dtype": "number", "shape": []}},
+        name="primary",
+    )
+    yield "descriptor", stream.descriptor_doc
+    events = [
+        stream.compose_event(
+            data={data_key: 1 / (seq_num + 2)},
+            timestamps={data_key: 0.0},
+            seq_num=seq_num,
+        )
+        for seq_num in range(1, 4)
+    ]
+    if as_event_page:
+        yield "event_page", event_model.pack_event_page(*events)
+    else:
+        yield from (("event", event) for event in events)
+    yield "stop", run.compose_stop(reason=reason)
+
+
+@pytest.mark.parametrize(
+    "column_data",
+    [
+        # every column is a single data value
+        ("{data[det][0]}", "{data[det][0]:.3}"),
+        # the general case
+        ("{data[det][0]}", "{seq_num[0]}: {data[det][0]:.3}"),
+    ],
+)
+def test_event_page_rows(column_data):
+    # an event page with several events is written as one row per event
+    # exactly as if the events had arrived one at a time
+    column_config = "".join(
+        f'"Column.{i}" = {{column_label="c{i}", data_key="det", column_data="{c}"}}\n'
+        for i, c in enumerate(column_data, start=1)
+    )
+    xdi_config = "\n".join(
+        line for line in config.splitlines() if not line.startswith('"Column.')
+    ).replace("[columns]", "[columns]\n" + column_config)
+
+    def data_rows(as_event_page):
+        documents = run_documents(xdi_config, as_event_page=as_event_page)
+        artifacts = export(documents, MemoryBuffersManager())
+        (buffer,) = artifacts["stream_data"]
+        return buffer.getvalue().decode().split("#----\n")[1].splitlines()[1:]
+
+    assert len(data_rows(as_event_page=False)) == 3
+    assert data_rows(as_event_page=True) == data_rows(as_event_page=False)
+
+
+def test_no_data_to_export():
+    # no file is written for a run without the data keys of the columns
+    artifacts = export(run_documents(config, data_key="motor"), MemoryBuffersManager())
+
+    assert "stream_data" not in artifacts
+
+
+# a header field filled from the stop document, a long stop reason makes the
+# final header longer than the region reserved for it
+stop_reason_config = config.replace(
+    "[optional_headers]",
+    '"Scan.stop_reason" = {data="{reason}"}\n\n[optional_headers]',
+)
+
+
+@pytest.mark.parametrize("use_memory_buffers", [False, True])
+def test_header_exceeds_reserved_region(tmp_path, use_memory_buffers):
+    # when the final header is longer than the region reserved for it the
+    # output is rewritten with the full header followed by exactly the data
+    # rows written before the stop document
+    reason = "x" * (2 * _HEADER_REGION_SIZE)
+
+    def read_output(documents, directory):
+        artifacts = export(documents, directory)
+        (artifact,) = artifacts["stream_data"]
+        if isinstance(artifact, Path):
+            return artifact.read_text()
+        return artifact.getvalue().decode()
+
+    # the same run with a short stop reason gives the expected data rows
+    data_rows = read_output(
+        run_documents(stop_reason_config), MemoryBuffersManager()
+    ).splitlines(keepends=True)[-3:]
+
+    directory = MemoryBuffersManager() if use_memory_buffers else tmp_path
+    header, data = read_output(
+        run_documents(stop_reason_config, reason=reason), directory
+    ).split("#----\n")
+    assert header.startswith("# XDI/1.0 Bluesky\n")
+    assert f"# Scan.stop_reason = {reason}\n" in header
+    assert "# Scan.end_time = None\n" not in header
+    # no padding is left from the reserved header region
+    assert data == "# energy\tmutrans\ti0\n" + "".join(data_rows)
+
+    # the temporary file used to rewrite a file is not left behind
+    assert list(tmp_path.glob("*.updating")) == []
+
+
+def test_event_override():
+    # Serializer.__call__ routes 'event' documents through the event method
+    # and Serializer.event sends them on to event_page
+    class CountingSerializer(Serializer):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.event_count = 0
+
+        def event(self, doc):
+            self.event_count += 1
+            return super().event(doc)
+
+    with CountingSerializer(MemoryBuffersManager()) as serializer:
+        for name, doc in run_documents(config):
+            assert serializer(name, doc) == (name, doc)
+
+    assert serializer.event_count == 3
+    # Serializer.event writes the data of each event
+    (buffer,) = serializer.artifacts["stream_data"]
+    assert len(buffer.getvalue().decode().split("#----\n")[1].splitlines()) == 4